@@ -8,7 +8,12 @@ __all__ = ["BuyCheapSellExpensiveAgent"]
 class BuyCheapSellExpensiveAgent(IndependentNegotiationsAgent):
     """An agent that tries to buy cheap and sell expensive but does not care about production scheduling."""
 
+    # weights of (quantity, time, unit_price) when selling and buying
+    _SELLER_WEIGHTS = (1, 1, 10)
+    _BUYER_WEIGHTS = (1, -1, -10)
+
     def create_ufun(self, is_seller: bool, issues=None, outcomes=None):
-        if is_seller:
-            return LinearUtilityFunction((1, 1, 10))
-        return LinearUtilityFunction((1, -1, -10))
+        # negmas binds a ufun to the negotiation its negotiator joins so instances cannot be shared between negotiators
+        return LinearUtilityFunction(
+            self._SELLER_WEIGHTS if is_seller else self._BUYER_WEIGHTS
+        )
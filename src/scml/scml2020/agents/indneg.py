@@ -13,8 +13,10 @@ The main assumptions of the agents based on `IndependentNegotiationsAgent` are:
 
 """
 
+import functools
+import itertools
 from abc import abstractmethod
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Optional, Dict, Any, Union, Tuple
 
 import numpy as np
 from negmas import (
@@ -25,13 +27,56 @@ from negmas import (
     SAONegotiator,
 )
 from negmas import AspirationNegotiator
-from negmas.helpers import get_class, instantiate
+from negmas.helpers import get_class
 
 from .do_nothing import DoNothingAgent
 
 __all__ = ["IndependentNegotiationsAgent"]
 
 
+@functools.lru_cache(maxsize=1024)
+def _agenda(qvalues: Tuple[int, int], tvalues: Tuple[int, int], uvalues: Tuple[int, int]):
+    """
+    Creates the issues of a negotiation agenda with the given ranges and counts its outcomes.
+
+    Results are cached as the same ranges recur frequently. Returned issues must not be modified.
+    """
+    issues = (
+        Issue(qvalues, name="quantity", value_type=int),
+        Issue(tvalues, name="time", value_type=int),
+        Issue(uvalues, name="unit_price", value_type=int),
+    )
+    return issues, Issue.num_outcomes(issues)
+
+
+def _sell_terms(quantity, n_inputs, n_outputs, cost, price):
+    """
+    Finds the quantity and minimum unit price for selling the output of processing `quantity` inputs bought at `price`.
+
+    Works with scalars and with numpy arrays (element-wise).
+    """
+    # avoid division by zero error in numpy
+    with np.errstate(divide="ignore"):
+        return (
+            np.maximum(1, quantity * n_outputs // n_inputs),
+            (cost + price * n_inputs) // n_outputs,
+        )
+
+
+def _buy_terms(quantity, n_inputs, n_outputs, cost, price):
+    """
+    Finds the quantity and maximum unit price for buying the inputs needed to produce `quantity` outputs sold at `price`.
+
+    Works with scalars and with numpy arrays (element-wise).
+    """
+    # avoid division by zero error in numpy
+    with np.errstate(divide="ignore"):
+        return (
+            np.maximum(1, quantity * n_inputs // n_outputs),
+            (n_outputs * price - cost) // n_inputs,
+        )
+
+
 class IndependentNegotiationsAgent(DoNothingAgent):
     """
     Implements the base class for agents that negotiate independently with different partners.
@@ -70,82 +115,116 @@ class IndependentNegotiationsAgent(DoNothingAgent):
         self.negotiator_params = (
             negotiator_params if negotiator_params is not None else dict()
         )
+        self._negotiator_ctor = functools.partial(
+            self.negotiator_type, **self.negotiator_params
+        )
         self.costs: np.ndarray = None
+        self._catalog_prices: np.ndarray = None
+        self._n_inputs: np.ndarray = None
+        self._n_outputs: np.ndarray = None
         self.horizon = horizon
 
     def init(self):
         """Initializes the agent by finding the average production cost."""
-        self.costs = np.ceil(
-            np.sum(self.awi.profile.costs, axis=0) / self.awi.profile.n_lines
-        ).astype(int)
-
-        self.expected_sales = np.zeros(self.awi.n_steps)
-        self.expected_supplies = np.zeros(self.awi.n_steps)
-        n = len(self.awi.profile.exogenous_sales)
-        self.expected_sales[:n] = self.awi.profile.exogenous_sales[:, self.awi.my_output_product]
-        self.expected_supplies[:n] = self.awi.profile.exogenous_supplies[:, self.awi.my_input_product]
+        profile = self.awi.profile
+        # ceil of the mean over lines computed in integer arithmetic
+        self.costs = -(-profile.costs.sum(axis=0, dtype=np.int64) // profile.n_lines)
+        # catalog prices and the number of inputs/outputs of every process are fixed for the whole simulation
+        self._catalog_prices = np.asarray(self.awi.catalog_prices, dtype=np.int64)
+        self._n_inputs = np.asarray(self.awi.inputs, dtype=np.int64)
+        self._n_outputs = np.asarray(self.awi.outputs, dtype=np.int64)
+
+        # expected quantities to sell/buy of every product at every step (n_steps * n_products)
+        shape = (self.awi.n_steps, self.awi.n_products)
+        self.expected_sales = np.zeros(shape, dtype=np.int64)
+        self.expected_supplies = np.zeros(shape, dtype=np.int64)
+        self._n_revealed = 0
+        self._update_expected_quantities()
+
+    def _update_expected_quantities(self):
+        """Copies exogenous sales/supplies revealed since the last call into the expected quantities"""
+        profile = self.awi.profile
+        n, start = len(profile.exogenous_sales), self._n_revealed
+        if n <= start:
+            return
+        self.expected_sales[start:n] += profile.exogenous_sales[start:]
+        self.expected_supplies[start:n] += profile.exogenous_supplies[start:]
+        self._n_revealed = n
 
     def step(self):
         """Every `horizon` steps, create new negotiations based on external supplies and sales."""
 
-        # avoid division by zero error in numpy
-        np.seterr(divide="ignore")
-
-        # update expected sales and supplies
-        n = len(self.awi.profile.exogenous_sales)
-        self.expected_sales[n-1] += self.awi.profile.exogenous_sales[n-1, self.awi.my_output_product]
-        self.expected_supplies[n-1] += self.awi.profile.exogenous_supplies[n-1, self.awi.my_input_product]
+        # update expected sales and supplies with newly revealed exogenous quantities
+        self._update_expected_quantities()
 
         # only run this process once every `horizon` steps
-        if self.awi.current_step % self.horizon != 0:
+        awi = self.awi
+        earliest = awi.current_step
+        if earliest % self.horizon != 0:
             return
-        input_products = self.awi.my_input_products
-        output_products = self.awi.my_output_products
-        earliest = self.awi.current_step
-        final = min(earliest + self.horizon - 1, self.awi.n_steps)
+        final = min(earliest + self.horizon - 1, awi.n_steps)
+
+        # find the catalog prices, process inputs/outputs and production costs
+        prices, inputs, outputs = self._catalog_prices, self._n_inputs, self._n_outputs
+        costs = self.costs
+        start_negotiations = self.start_negotiations
 
         # if I have external inputs, negotiate to sell them (after production)
         supplies = self.expected_supplies[earliest:final]
-        quantity = np.sum(supplies)
-
-        # find the supply prices
-        prices = self.awi.catalog_prices
-
-        # for every step and product, start negotiations to sell the output of this external supply
-        nonzero = np.transpose(np.nonzero(supplies))
-        for step, i in nonzero:
-            process = input_products[i]
-            price = prices[i]
-            output_product = process + 1
-            n_inputs = self.awi.inputs[process]
-            cost = self.costs[process]
-            n_outputs = self.awi.outputs[process]
-            self.start_negotiations(
-                product=output_product,
-                quantity=max(1, quantity[i] * n_outputs // n_inputs),
-                unit_price=(cost + price * n_inputs) // n_outputs,
-                time=step + final + 1,
-                to_buy=False,
+        steps, processes = np.nonzero(supplies)
+        if len(steps) > 0:
+            # for every step and product, start negotiations to sell the output of this external supply
+            quantity = supplies.sum(axis=0)
+            quantities, unit_prices = _sell_terms(
+                quantity[processes],
+                inputs[processes],
+                outputs[processes],
+                costs[processes],
+                prices[processes],
             )
+            times = steps + final + 1
+            for product, quantity, unit_price, time in zip(
+                (processes + 1).tolist(),
+                quantities.tolist(),
+                unit_prices.tolist(),
+                times.tolist(),
+            ):
+                start_negotiations(
+                    product=product,
+                    quantity=quantity,
+                    unit_price=unit_price,
+                    time=time,
+                    to_buy=False,
+                )
 
         # if I have external outputs, negotiate to buy corresponding inputs
         sales = self.expected_sales[earliest:final]
-        quantity = np.sum(sales, axis=0)
-        nonzero = np.transpose(np.nonzero(sales))
-        for step, o in nonzero:
-            output_product = output_products[o]
-            process = output_product - 1
-            price = prices[o]
-            n_inputs = self.awi.inputs[process]
-            cost = self.costs[process]
-            n_outputs = self.awi.outputs[process]
-            self.start_negotiations(
-                product=process,
-                quantity=max(1, quantity[o] * n_inputs // n_outputs),
-                unit_price=(n_outputs * price - cost) // n_inputs,
-                time=step + earliest - 1,
-                to_buy=True,
+        steps, output_products = np.nonzero(sales)
+        if len(steps) > 0:
+            # for every step and product, start negotiations to buy the inputs needed for this external sale
+            quantity = sales.sum(axis=0)
+            processes = output_products - 1
+            quantities, unit_prices = _buy_terms(
+                quantity[output_products],
+                inputs[processes],
+                outputs[processes],
+                costs[processes],
+                prices[output_products],
             )
+            times = steps + earliest - 1
+            for product, quantity, unit_price, time in zip(
+                processes.tolist(),
+                quantities.tolist(),
+                unit_prices.tolist(),
+                times.tolist(),
+            ):
+                start_negotiations(
+                    product=product,
+                    quantity=quantity,
+                    unit_price=unit_price,
+                    time=time,
+                    to_buy=True,
+                )
 
     @abstractmethod
     def create_ufun(self, is_seller: bool, issues=None, outcomes=None):
@@ -154,11 +233,8 @@ class IndependentNegotiationsAgent(DoNothingAgent):
 
     def negotiator(self, is_seller: bool, issues=None, outcomes=None) -> SAONegotiator:
         """Creates a negotiator"""
-        params = self.negotiator_params
-        params["ufun"] = self.create_ufun(
-            is_seller=is_seller, outcomes=outcomes, issues=issues
-        )
-        return instantiate(self.negotiator_type, **params)
+        ufun = self.create_ufun(is_seller=is_seller, outcomes=outcomes, issues=issues)
+        return self._negotiator_ctor(ufun=ufun)
 
     def respond_to_negotiation_request(
         self,
@@ -197,64 +273,90 @@ class IndependentNegotiationsAgent(DoNothingAgent):
             - This method assumes that products cannot be in my_input_products and my_output_products
 
         """
-        if quantity < 1 or unit_price < 1 or time < self.awi.current_step + 1:
-            self.awi.logdebug(
+        awi = self.awi
+        current_step = awi.current_step
+        # issues are integer valued so the ranges must not be floats or numpy scalars
+        quantity, unit_price, time = int(quantity), int(unit_price), int(time)
+        if quantity < 1 or unit_price < 1 or time < current_step + 1:
+            awi.logdebug(
                 f"Less than 2 valid issues (q:{quantity}, u:{unit_price}, t:{time})"
             )
             return
+        partners = (awi.all_suppliers if to_buy else awi.all_consumers)[product]
+        if not partners:
+            awi.logdebug(f"No partners to {'buy' if to_buy else 'sell'} product {product}")
+            return
         # choose ranges for the negotiation agenda.
-        cprice = self.awi.catalog_prices[product]
+        cprice = int(self._catalog_prices[product])
         qvalues = (1, quantity)
         if to_buy:
             uvalues = (1, cprice)
-            tvalues = (self.awi.current_step + 1, time - 1)
-            partners = self.awi.all_suppliers[product]
+            tvalues = (current_step + 1, time - 1)
         else:
             uvalues = (cprice, 2 * cprice)
-            tvalues = (time + 1, self.awi.n_steps - 1)
-            partners = self.awi.all_consumers[product]
-        issues = [
-            Issue(qvalues, name="quantity", value_type=int),
-            Issue(tvalues, name="time", value_type=int),
-            Issue(uvalues, name="unit_price", value_type=int),
-        ]
-        if Issue.num_outcomes(issues) < 2:
-            self.awi.logdebug(
+            tvalues = (time + 1, awi.n_steps - 1)
+        issues, n_outcomes = _agenda(qvalues, tvalues, uvalues)
+        if n_outcomes < 2:
+            awi.logdebug(
                 f"Less than 2 issues for product {product}: {[str(_) for _ in issues]}"
             )
             return
 
-        # negotiate with all suppliers of the input product I need to produce
+        # negotiate with all suppliers of the input product I need to produce. Only the partner and the negotiator
+        # differ between these negotiations. `AWI.request_negotiations` is not used because it requires a single
+        # controller for all negotiations.
+        request_negotiation = functools.partial(
+            awi.request_negotiation,
+            is_buy=to_buy,
+            product=product,
+            quantity=qvalues,
+            unit_price=uvalues,
+            time=tvalues,
+        )
+        negotiator, issues = self.negotiator, list(issues)
         for partner in partners:
-            self.awi.request_negotiation(
-                is_buy=to_buy,
-                product=product,
-                quantity=qvalues,
-                unit_price=uvalues,
-                time=tvalues,
-                partner=partner,
-                negotiator=self.negotiator(not to_buy, issues=issues),
+            request_negotiation(
+                partner=partner, negotiator=negotiator(not to_buy, issues=issues)
             )
 
     def sign_all_contracts(self, contracts: List[Contract]) -> List[Optional[str]]:
-        results = [None] * len(contracts)
-        for i, contract in enumerate( contracts):
-            step = contract.agreement["time"]
-            q = contract.agreement["quantity"]
-            if step > self.awi.n_steps - 1 or step < self.awi.current_step:
-                continue
-            if contract.annotation["seller"] == self.id:
-                steps, lines = self.awi.available_for_production(
-                    q, (self.awi.current_step, step), -1, override=False, method="all"
-                )
-                if len(steps) < q:
-                    continue
-            results[i] = self.id
-            if contract.annotation["seller"] == self.id:
-                self.expected_sales[step] += q
-            else:
-                self.expected_supplies[step] += q
-        return results
+        if not contracts:
+            return []
+        awi, n = self.awi, len(contracts)
+        current_step = awi.current_step
+        agreements = [_.agreement for _ in contracts]
+        annotations = [_.annotation for _ in contracts]
+        steps = np.fromiter((_["time"] for _ in agreements), dtype=np.int64, count=n)
+        quantities = np.fromiter(
+            (_["quantity"] for _ in agreements), dtype=np.int64, count=n
+        )
+        products = np.fromiter(
+            (_["product"] for _ in annotations), dtype=np.int64, count=n
+        )
+        is_seller = np.fromiter(
+            (_["seller"] == self.id for _ in annotations), dtype=bool, count=n
+        )
+
+        # reject contracts outside the simulation in one pass
+        valid = (steps <= awi.n_steps - 1) & (steps >= current_step)
+
+        # only check production capacity for the remaining sell contracts
+        for i, q, step in itertools.compress(
+            zip(range(n), quantities.tolist(), steps.tolist()),
+            (valid & is_seller).tolist(),
+        ):
+            available, _ = awi.available_for_production(
+                q, (current_step, step), -1, override=False, method="all"
+            )
+            if len(available) < q:
+                valid[i] = False
+
+        sold, bought = valid & is_seller, valid & ~is_seller
+        np.add.at(self.expected_sales, (steps[sold], products[sold]), quantities[sold])
+        np.add.at(
+            self.expected_supplies, (steps[bought], products[bought]), quantities[bought]
+        )
+        return [self.id if _ else None for _ in valid.tolist()]
 
     def on_contracts_finalized(
         self,
@@ -262,54 +364,87 @@ class IndependentNegotiationsAgent(DoNothingAgent):
         cancelled: List[Contract],
         rejectors: List[List[str]],
     ) -> None:
-        for contract in signed:
-            is_seller = contract.annotation["seller"] == self.id
-            step = contract.agreement["time"]
-            # find the earliest time I can do anything about this contract
-            earliest_production = self.awi.current_step
-            if step > self.awi.n_steps - 1 or step < earliest_production:
-                continue
-            if is_seller:
-                # if I am a seller, I will schedule production then buy my needs to produce
-                output_product = contract.annotation["product"]
-                input_product = output_product - 1
-                if input_product >= 0:
-                    steps, _ = self.awi.schedule_production(
-                        process=input_product,
-                        repeats=contract.agreement["quantity"],
-                        step=(earliest_production, step - 1),
-                        line=-1,
-                    )
-                    if len(steps) < 1:
-                        continue
-                    scheduled_at = steps.min()
-                    n_inputs = self.awi.inputs[input_product]
-                    cost = self.costs[input_product]
-                    n_outputs = self.awi.outputs[input_product]
-                    self.start_negotiations(
-                        product=input_product,
-                        quantity=max(
-                            1, contract.agreement["quantity"] * n_inputs // n_outputs
-                        ),
-                        unit_price=(n_outputs * contract.agreement["unit_price"] - cost)
-                        // n_inputs,
-                        time=scheduled_at - 1,
-                        to_buy=True,
-                    )
-                continue
+        if not signed:
+            return
+        awi, n = self.awi, len(signed)
+        # find the earliest time I can do anything about these contracts
+        earliest_production = awi.current_step
+        is_seller = np.fromiter(
+            (_.annotation["seller"] == self.id for _ in signed), dtype=bool, count=n
+        )
+        products = np.fromiter(
+            (_.annotation["product"] for _ in signed), dtype=np.int64, count=n
+        )
+        quantities = np.fromiter(
+            (_.agreement["quantity"] for _ in signed), dtype=np.int64, count=n
+        )
+        unit_prices = np.fromiter(
+            (_.agreement["unit_price"] for _ in signed), dtype=np.int64, count=n
+        )
+        steps = np.fromiter((_.agreement["time"] for _ in signed), dtype=np.int64, count=n)
+
+        # the process I need to run to deliver what I sold or to use what I bought
+        processes = np.where(is_seller, products - 1, products)
+        valid = (
+            (steps <= awi.n_steps - 1)
+            & (steps >= earliest_production)
+            & (processes >= 0)
+            & (processes < awi.n_processes)
+        )
+        indices = np.flatnonzero(valid)
+        if len(indices) < 1:
+            return
+        processes, is_seller = processes[indices], is_seller[indices]
+        quantities, unit_prices, steps = (
+            quantities[indices],
+            unit_prices[indices],
+            steps[indices],
+        )
 
-            # I am a buyer. I need not produce anything but I need to negotiate to sell the production of what I bought
-            input_product = contract.annotation["product"]
-            output_product = input_product + 1
-            if output_product < self.awi.n_products:
-                n_inputs = self.awi.inputs[input_product]
-                cost = self.costs[input_product]
-                n_outputs = self.awi.outputs[input_product]
+        # as a seller, I need to buy my needs to produce. As a buyer, I need to sell the production of what I bought
+        terms = (
+            quantities,
+            self._n_inputs[processes],
+            self._n_outputs[processes],
+            self.costs[processes],
+            unit_prices,
+        )
+        buy_quantities, buy_prices = _buy_terms(*terms)
+        sell_quantities, sell_prices = _sell_terms(*terms)
+        new_quantities = np.where(is_seller, buy_quantities, sell_quantities)
+        new_prices = np.where(is_seller, buy_prices, sell_prices)
+
+        for seller, process, repeats, step, quantity, unit_price in zip(
+            is_seller.tolist(),
+            processes.tolist(),
+            quantities.tolist(),
+            steps.tolist(),
+            new_quantities.tolist(),
+            new_prices.tolist(),
+        ):
+            if not seller:
+                # I am a buyer. I need not produce anything
                 self.start_negotiations(
-                    product=output_product,
-                    quantity=max(1, contract.agreement["quantity"] * n_inputs / n_outputs),
-                    unit_price=(cost + contract.agreement["unit_price"] * n_inputs)
-                    // n_outputs,
+                    product=process + 1,
+                    quantity=quantity,
+                    unit_price=unit_price,
                     time=step - 1,
                     to_buy=False,
                 )
+                continue
+            # I am a seller. I will schedule production before buying my needs
+            scheduled, _ = awi.schedule_production(
+                process=process,
+                repeats=repeats,
+                step=(earliest_production, step - 1),
+                line=-1,
+            )
+            if len(scheduled) < 1:
+                continue
+            self.start_negotiations(
+                product=process,
+                quantity=quantity,
+                unit_price=unit_price,
+                time=int(scheduled.min()) - 1,
+                to_buy=True,
+            )
@@ -3,11 +3,9 @@
 import math
 import sys
 from abc import ABC, abstractmethod
-from collections import defaultdict
-from typing import Dict, List, Optional, Tuple, Union
+from typing import List, Optional, Tuple, Union
 import numpy as np
-from dataclasses import dataclass, field
-from contextlib import contextmanager
+from dataclasses import dataclass
 
 from negmas.java import to_java, to_dict
 from scml.scml2020 import (
@@ -42,7 +40,9 @@ class AbstractFactorySimulator(ABC):
         self._initial_inventory = np.zeros(n_products)
         self._profile = profile
         self._n_products = n_products
-        self._reserved_inventory = np.zeros(shape=(n_products, profile.n_steps))
+        self._reserved_inventory = np.zeros(
+            shape=(n_products, profile.n_steps), dtype=np.int32
+        )
 
     # -----------------
     # FIXED PROPERTIES
@@ -652,40 +652,76 @@ class AbstractFactorySimulator(ABC):
         """
 
 
-@dataclass
-class _Bookmark:
-    id: int
-    jobs: Dict[int, List[int]] = field(
-        default_factory=lambda: defaultdict(list), init=False
-    )
-    buy_contracts: Dict[int, List[int]] = field(
-        default_factory=lambda: defaultdict(list), init=False
-    )
-    sell_contracts: Dict[int, List[int]] = field(
-        default_factory=lambda: defaultdict(list), init=False
-    )
-    payment_updates: Dict[int, int] = field(
-        default_factory=lambda: defaultdict(int), init=False
-    )
-    inventory_updates: Dict[int, Dict[int, int]] = field(
-        default_factory=lambda: defaultdict(lambda: defaultdict(int)), init=False
-    )
-
-
 @dataclass
 class _State:
+    __slots__ = ["t", "inventory", "wallet", "commands"]
     t: int
     inventory: np.array
     wallet: int
     commands: np.array
 
 
-@dataclass
-class _FullBookmark:
-    id: int
-    wallet: np.array
-    inventory: np.array
-    commands: np.array
+class _JournalBookmark:
+    """Records every change done to the simulator since the bookmark was set so that it can be undone.
+
+    Changes are stored column-wise (one list per field) so that they can be undone in a few vectorized operations:
+
+        - wallet_amounts[i] was added to the wallet at and after wallet_steps[i]
+        - inventory_amounts[i] was added to the inventory of inventory_products[i] at and after inventory_steps[i]
+        - command_values[i] was the command at command_steps[i], command_lines[i] before it was changed
+    """
+
+    __slots__ = [
+        "id",
+        "wallet_steps",
+        "wallet_amounts",
+        "inventory_products",
+        "inventory_steps",
+        "inventory_amounts",
+        "command_steps",
+        "command_lines",
+        "command_values",
+    ]
+
+    def __init__(self, id: int):
+        self.id = id
+        for name in self.__slots__[1:]:
+            setattr(self, name, [])
+
+    def record_commands(
+        self, steps: List[int], lines: List[int], commands: List[int]
+    ) -> None:
+        """Records replacing the given commands at the given steps/lines"""
+        self.command_steps += steps
+        self.command_lines += lines
+        self.command_values += commands
+
+    def record_runs(
+        self,
+        process: int,
+        steps: List[int],
+        lines: List[int],
+        commands: List[int],
+        costs: List[int],
+    ) -> None:
+        """Records running process at the given steps/lines (replacing the given commands) paying the given costs"""
+        n = len(steps)
+        self.record_commands(steps, lines, commands)
+        self.inventory_products += [process] * n + [process + 1] * n
+        self.inventory_steps += steps + steps
+        self.inventory_amounts += [-1] * n + [1] * n
+        self.wallet_steps += steps
+        self.wallet_amounts += [-_ for _ in costs]
+
+    def extend(self, other: "_JournalBookmark") -> None:
+        """Appends all changes recorded in other"""
+        for name in self.__slots__[1:]:
+            getattr(self, name).extend(getattr(other, name))
+
+    def clear(self) -> None:
+        """Forgets all recorded changes"""
+        for name in self.__slots__[1:]:
+            getattr(self, name).clear()
 
 
 class FactorySimulator(AbstractFactorySimulator):
@@ -705,28 +741,31 @@ class FactorySimulator(AbstractFactorySimulator):
         super().__init__(initial_balance=initial_balance, profile=profile)
         self.bankruptcy_limit = bankruptcy_limit
         self.breach_penalty = breach_penalty
-        n_steps, n_products, n_processes = (
-            self._n_steps,
-            self._n_products,
-            self._n_products - 1,
-        )
+        n_steps, n_products = self._n_steps, self._n_products
         self._n_lines = profile.n_lines
-        self._wallet = np.ones(n_steps) * initial_balance
-        if initial_inventory is None:
-            initial_inventory = np.zeros(n_products, dtype=int)
-
-        self._inventory = initial_inventory
-        self._inventory = np.repeat(
-            initial_inventory.reshape((n_products, 1)), n_steps, axis=1
-        )
-        self._profile = profile
-        self.commands = (
-            np.ones(shape=(self._n_lines, self._n_steps), dtype=int) * NO_COMMAND
+        # the wallet and inventory are stored as the change at every step. Their values at every step are the
+        # cumulative sums of these changes and are only computed (and cached) when read.
+        self._wallet_delta = np.zeros(n_steps, dtype=np.int64)
+        self._wallet_delta[0] = initial_balance
+        if initial_inventory is not None:
+            self._initial_inventory = initial_inventory
+        self._inventory_delta = np.zeros(shape=(n_products, n_steps), dtype=np.int32)
+        self._inventory_delta[:, 0] = self._initial_inventory
+        self._wallet_cache: Optional[np.ndarray] = None
+        self._wallet_min: Optional[int] = None
+        self._inventory_cache: Optional[np.ndarray] = None
+        # the profile is fixed. Keep the costs of every process (over lines) contiguous and as python lists for
+        # the scheduling kernel
+        self._process_costs = np.ascontiguousarray(profile.costs.T)
+        self._process_cost_lists = self._process_costs.tolist()
+        self.commands = np.full(
+            (self._n_steps, self._n_lines), NO_COMMAND, dtype=np.int16
         )
-        self.commands = np.zeros(shape=(self._n_lines, self._n_steps), dtype=int)
         self._fixed_before = 0
-        self._bookmarks: List[_FullBookmark] = []
-        self._active_bookmark: Optional[_FullBookmark] = None
+        # a stack of bookmarks. Bookmark objects are reused after they are deleted
+        self._bookmarks: List[Optional[_JournalBookmark]] = [None] * 8
+        self._n_bookmarks = 0
+        self._active_bookmark: Optional[_JournalBookmark] = None
 
     def init(self, *args, **kwargs):
         self.__init__(*args, **kwargs)
@@ -739,13 +778,33 @@ class FactorySimulator(AbstractFactorySimulator):
     def n_lines(self):
         return self._n_lines
 
+    @property
+    def _wallet(self) -> np.ndarray:
+        """The cash in the wallet at every step"""
+        if self._wallet_cache is None:
+            self._wallet_cache = np.cumsum(self._wallet_delta)
+        return self._wallet_cache
+
+    @property
+    def _inventory(self) -> np.ndarray:
+        """The quantity of every product in the inventory at every step"""
+        if self._inventory_cache is None:
+            self._inventory_cache = np.cumsum(
+                self._inventory_delta, axis=1, dtype=np.int32
+            )
+        return self._inventory_cache
+
     @property
     def final_balance(self) -> int:
-        return self._wallet[-1]
+        if self._wallet_cache is None:
+            return self._wallet_delta.sum()
+        return self._wallet_cache[-1]
 
     def is_bankrupt(self) -> bool:
         """Checks if the agent will go bankrupt given all the info so far"""
-        return np.min(self._wallet) < self.bankruptcy_limit
+        if self._wallet_min is None:
+            self._wallet_min = self._wallet.min()
+        return self._wallet_min < self.bankruptcy_limit
 
     def wallet_to(self, t: int) -> np.array:
         return self._wallet[: t + 1]
@@ -754,7 +813,37 @@ class FactorySimulator(AbstractFactorySimulator):
         return self._inventory[:, : t + 1]
 
     def line_schedules_to(self, t: int) -> np.array:
-        return self.commands[:, : t + 1]
+        return self.commands[: t + 1, :].T
+
+    def _update_wallet(self, amount: int, t: int) -> None:
+        """Adds amount to the wallet at and after t recording the change in the active bookmark"""
+        self._wallet_delta[t] += amount
+        self._wallet_cache = self._wallet_min = None
+        if self._active_bookmark is not None:
+            self._active_bookmark.wallet_steps.append(t)
+            self._active_bookmark.wallet_amounts.append(amount)
+
+    def _update_inventory(self, product: int, amount: int, t: int) -> None:
+        """Adds amount to the inventory of product at and after t recording the change in the active bookmark"""
+        self._inventory_delta[product, t] += amount
+        self._inventory_cache = None
+        if self._active_bookmark is not None:
+            self._active_bookmark.inventory_products.append(product)
+            self._active_bookmark.inventory_steps.append(t)
+            self._active_bookmark.inventory_amounts.append(amount)
+
+    def _trade(self, product: int, quantity: int, payment: int, t: int) -> None:
+        """Adds quantity of product to the inventory and pays payment at and after t in one update (no checks)"""
+        self._inventory_delta[product, t] += quantity
+        self._wallet_delta[t] -= payment
+        self._wallet_cache = self._wallet_min = self._inventory_cache = None
+        bookmark = self._active_bookmark
+        if bookmark is not None:
+            bookmark.inventory_products.append(product)
+            bookmark.inventory_steps.append(t)
+            bookmark.inventory_amounts.append(quantity)
+            bookmark.wallet_steps.append(t)
+            bookmark.wallet_amounts.append(-payment)
 
     def pay(self, payment: int, t: int, ignore_money_shortage: bool = True) -> bool:
         # @todo add minimum balance
@@ -762,16 +851,14 @@ class FactorySimulator(AbstractFactorySimulator):
             raise ValueError(
                 f"Cannot run operations in the past (t={t}, fixed before {self._fixed_before})"
             )
-        b = self._wallet[t:]
-        if b.size < 1:
+        if t >= self._n_steps:
             return False
-        if ignore_money_shortage:
-            b -= payment
-            return True
-        b -= payment
-        if b.min() < self.bankruptcy_limit:
-            b += payment
+        if (
+            not ignore_money_shortage
+            and self._wallet[t:].min() - payment < self.bankruptcy_limit
+        ):
             return False
+        self._update_wallet(-payment, t)
         return True
         # interest rate computation. Ignored for now
         # backup = b.copy()
@@ -795,15 +882,14 @@ class FactorySimulator(AbstractFactorySimulator):
             raise ValueError(
                 f"Cannot run operations in the past (t={t}, fixed before {self._fixed_before})"
             )
-        s = self._inventory[product, t:].view()
-        if s.size < 1:
+        if t >= self._n_steps:
             return False
-        s += quantity
-        if ignore_inventory_shortage:
-            return True
-        if s.min() < 0:
-            s -= quantity
+        if (
+            not ignore_inventory_shortage
+            and self._inventory[product, t:].min() + quantity < 0
+        ):
             return False
+        self._update_inventory(product, quantity, t)
         return True
 
     def buy(
@@ -818,11 +904,16 @@ class FactorySimulator(AbstractFactorySimulator):
             raise ValueError(
                 f"Cannot run operations in the past (t={t}, fixed before {self._fixed_before})"
             )
-        wallet = self._wallet.copy()
-        if not self.pay(price * quantity, t, ignore_money_shortage):
-            self._wallet = wallet
+        if t >= self._n_steps:
             return False
-        return self.transport_to(product, quantity, t, True)
+        payment = price * quantity
+        if (
+            not ignore_money_shortage
+            and self._wallet[t:].min() - payment < self.bankruptcy_limit
+        ):
+            return False
+        self._trade(product, quantity, payment, t)
+        return True
 
     def sell(
         self,
@@ -836,11 +927,15 @@ class FactorySimulator(AbstractFactorySimulator):
             raise ValueError(
                 f"Cannot run operations in the past (t={t}, fixed before {self._fixed_before})"
             )
-        inventory = self._inventory.copy()
-        if not self.transport_to(product, -quantity, t, ignore_inventory_shortage):
-            self._inventory = inventory
+        if t >= self._n_steps:
             return False
-        return self.pay(-price * quantity, t, True)
+        if (
+            not ignore_inventory_shortage
+            and self._inventory[product, t:].min() - quantity < 0
+        ):
+            return False
+        self._trade(product, -quantity, -price * quantity, t)
+        return True
 
     def available_for_production(
         self,
@@ -883,29 +978,28 @@ class FactorySimulator(AbstractFactorySimulator):
                 step = (step, step + 1)
         else:
             step = (step[0], step[1] + 1)
-        step = (max(current_step, step[0]), step[1])
+        step = (max(current_step, step[0]), min(step[1], self._n_steps))
         if step[1] <= step[0]:
             return np.empty(shape=0, dtype=int), np.empty(shape=0, dtype=int)
         if override:
+            # every line is available at every step. No need to look at the commands
+            n_steps = step[1] - step[0]
             if line < 0:
-                steps, lines = np.nonzero(
-                    self.commands[step[0] : step[1], :] >= NO_COMMAND
-                )
+                steps = np.repeat(np.arange(n_steps), self._n_lines)
+                lines = np.tile(np.arange(self._n_lines), n_steps)
             else:
-                steps = np.nonzero(
-                    self.commands[step[0] : step[1], line] >= NO_COMMAND
-                )[0]
-                lines = [line]
+                steps = np.arange(n_steps)
+                lines = np.full(n_steps, line)
         else:
             if line < 0:
                 steps, lines = np.nonzero(
                     self.commands[step[0] : step[1], :] == NO_COMMAND
                 )
             else:
-                steps = np.nonzero(
+                steps = np.flatnonzero(
                     self.commands[step[0] : step[1], line] == NO_COMMAND
-                )[0]
-                lines = [line]
+                )
+                lines = np.full(len(steps), line)
         steps += step[0]
         possible = min(repeats, len(steps))
         if possible < repeats:
@@ -935,8 +1029,13 @@ class FactorySimulator(AbstractFactorySimulator):
             - len(steps) must equal len(lines)
             - No checks are done in this function. It is expected to be used after calling `available_for_production`
         """
-        if len(steps) > 0:
-            self.commands[steps, lines] = process
+        steps, lines = np.asarray(steps, dtype=int), np.asarray(lines, dtype=int)
+        old = self.commands[steps, lines]
+        self.commands[steps, lines] = process
+        if self._active_bookmark is not None:
+            self._active_bookmark.record_commands(
+                steps.tolist(), lines.tolist(), old.tolist()
+            )
 
     def schedule(
         self,
@@ -949,37 +1048,87 @@ class FactorySimulator(AbstractFactorySimulator):
         ignore_inventory_shortage=True,
         ignore_money_shortage=True,
     ) -> bool:
+        if quantity <= 0:
+            return True
+        if not ignore_money_shortage:
+            # the last run cannot be scheduled unless the wallet, at its step, covers the cost of all the runs
+            first = t[0] if isinstance(t, tuple) else t
+            first = max(first, self._fixed_before + 1)
+            if (
+                first >= self._n_steps
+                or self._wallet[first:].max()
+                < quantity * self._process_costs[process].min()
+            ):
+                return False
         steps, lines = self.available_for_production(quantity, t, line, override, "all")
         if len(steps) < quantity:
             return False
-        cost = self._profile.costs[process]
-        # confirm that there is enough money to start production
-        if (not ignore_money_shortage) and np.any(self._wallet[t:] < cost):
+        # steps are sorted so every run in the longest prefix of the first `quantity` runs that are all possible
+        # given the runs before them will be scheduled and the run after that prefix will not
+        first_steps, first_lines = steps[:quantity], lines[:quantity]
+        costs = self._process_costs[process, first_lines]
+        possible = np.ones(quantity, dtype=bool)
+        if not ignore_inventory_shortage:
+            possible &= self._inventory[process, first_steps] - np.arange(quantity) >= 1
+        if not ignore_money_shortage:
+            possible &= self._wallet[first_steps] - np.cumsum(costs) >= 0
+        n_possible = quantity if possible.all() else int(np.argmin(possible))
+        if n_possible == quantity:
+            self._order_runs(process, first_steps, first_lines, costs)
+            return True
+        remaining = quantity - n_possible
+        if len(steps) - n_possible - 1 < remaining:
             return False
-        # bookmark to be able to rollback at any error
-        with transaction(self) as bookmark:
-            if not self.pay(cost, t):
-                self.rollback(bookmark)
-                return False
-            scheduled = 0
-            for s, l in zip(steps, lines):
-                if not ((ignore_inventory_shortage or self._inventory[process, s] >= 1) and (
-                    ignore_money_shortage
-                    or (
-                        self._wallet[s] >= cost
-                    )
-                )):
-                    continue
-                scheduled += 1
-                self.commands[s, l] = process
-                self._inventory[process, s] -= 1
-                self._inventory[process + 1, s] += 1
-                self._wallet[s] -= cost
-            if scheduled < quantity:
-                self.rollback(bookmark)
+        # try the rest one by one with a bookmark to be able to rollback at any error
+        with transaction(self):
+            self._order_runs(
+                process,
+                first_steps[:n_possible],
+                first_lines[:n_possible],
+                costs[:n_possible],
+            )
+            runs = _schedule_loop(
+                self.commands,
+                self._inventory,
+                self._wallet,
+                steps[n_possible + 1 :].tolist(),
+                lines[n_possible + 1 :].tolist(),
+                process,
+                self._process_cost_lists[process],
+                remaining,
+                ignore_inventory_shortage,
+                ignore_money_shortage,
+            )
+            # the loop keeps the cached wallet and inventory up to date. Record the changes in the per-step
+            # changes and in the transaction's bookmark so that they can be rolled back
+            self._wallet_min = None
+            bookmark = self._active_bookmark
+            if len(runs) > 0:
+                run_steps, run_lines, old, run_costs = (list(_) for _ in zip(*runs))
+                np.subtract.at(self._inventory_delta[process], run_steps, 1)
+                np.add.at(self._inventory_delta[process + 1], run_steps, 1)
+                np.subtract.at(self._wallet_delta, run_steps, run_costs)
+                bookmark.record_runs(process, run_steps, run_lines, old, run_costs)
+            if len(runs) < remaining:
+                self.rollback(bookmark.id)
                 return False
         return True
 
+    def _order_runs(
+        self, process: int, steps: np.ndarray, lines: np.ndarray, costs: np.ndarray
+    ) -> None:
+        """Runs process at the given steps/lines paying the given costs without any checks"""
+        old = self.commands[steps, lines]
+        self.commands[steps, lines] = process
+        np.subtract.at(self._inventory_delta[process], steps, 1)
+        np.add.at(self._inventory_delta[process + 1], steps, 1)
+        np.subtract.at(self._wallet_delta, steps, costs)
+        self._wallet_cache = self._wallet_min = self._inventory_cache = None
+        if self._active_bookmark is not None:
+            self._active_bookmark.record_runs(
+                process, steps.tolist(), lines.tolist(), old.tolist(), costs.tolist()
+            )
+
     def fix_before(self, t: int) -> bool:
         self._fixed_before = t
         return True
@@ -987,20 +1136,25 @@ class FactorySimulator(AbstractFactorySimulator):
     def delete_bookmark(self, bookmark_id: int) -> bool:
         if self._active_bookmark is None or self._active_bookmark.id != bookmark_id:
             raise ValueError(f"there is no active bookmark to delete")
-        self._bookmarks = self._bookmarks[:-1]
+        self._n_bookmarks -= 1
+        b = self._bookmarks[self._n_bookmarks]
         self._active_bookmark = (
-            self._bookmarks[-1] if len(self._bookmarks) > 0 else None
+            self._bookmarks[self._n_bookmarks - 1] if self._n_bookmarks > 0 else None
         )
+        # committed changes can still be rolled back by the enclosing bookmark
+        if self._active_bookmark is not None:
+            self._active_bookmark.extend(b)
+        b.clear()
         return True
 
     def bookmark(self) -> int:
-        bookmark = _FullBookmark(
-            id=len(self._bookmarks),
-            wallet=self._wallet.copy(),
-            inventory=self._inventory.copy(),
-            commands=self.commands.copy(),
-        )
-        self._bookmarks.append(bookmark)
+        n = self._n_bookmarks
+        if n == len(self._bookmarks):
+            self._bookmarks += [None] * n
+        bookmark = self._bookmarks[n]
+        if bookmark is None:
+            bookmark = self._bookmarks[n] = _JournalBookmark(id=n)
+        self._n_bookmarks = n + 1
         self._active_bookmark = bookmark
         return bookmark.id
 
@@ -1008,33 +1162,140 @@ class FactorySimulator(AbstractFactorySimulator):
         if self._active_bookmark is None or self._active_bookmark.id != bookmark_id:
             raise ValueError(f"there is no active bookmark to rollback")
         b = self._active_bookmark
-        self._wallet, self._inventory = b.wallet, b.inventory
-        self.commands = b.commands
+        if len(b.wallet_steps) > 0:
+            np.subtract.at(self._wallet_delta, b.wallet_steps, b.wallet_amounts)
+        if len(b.inventory_steps) > 0:
+            np.subtract.at(
+                self._inventory_delta,
+                (b.inventory_products, b.inventory_steps),
+                b.inventory_amounts,
+            )
+        self._wallet_cache = self._wallet_min = self._inventory_cache = None
+        if len(b.command_steps) > 0:
+            # in reverse so that the oldest value of every command is the one assigned last
+            steps, lines, values = (
+                _[::-1] for _ in (b.command_steps, b.command_lines, b.command_values)
+            )
+            self.commands[steps, lines] = values
+        b.clear()
         return True
 
     def set_state(
         self, t: int, inventory: np.array, wallet: int, commands: np.array
     ) -> None:
-        self._inventory[:, t:] += inventory.reshape(
-            self._n_products, 1
-        ) - self._inventory[:, t].reshape(self._n_products, 1)
-        self._wallet[t:] += wallet - self._wallet[t]
-        self.commands[:, t] = commands
+        # only the state at t is needed. Do not compute the cumulative sums for all steps if they are not cached
+        if self._inventory_cache is None:
+            current_inventory = self._inventory_delta[:, : t + 1].sum(axis=1)
+        else:
+            current_inventory = self._inventory_cache[:, t]
+        if self._wallet_cache is None:
+            current_wallet = self._wallet_delta[: t + 1].sum()
+        else:
+            current_wallet = self._wallet_cache[t]
+        changes = inventory - current_inventory
+        products = np.flatnonzero(changes)
+        changes = changes[products]
+        if len(products) > 0:
+            self._inventory_delta[products, t] += changes
+            self._inventory_cache = None
+        if wallet != current_wallet:
+            self._update_wallet(wallet - current_wallet, t)
+        old = self.commands[t, :].copy()
+        self.commands[t, :] = commands
+        bookmark = self._active_bookmark
+        if bookmark is not None:
+            bookmark.inventory_products += products.tolist()
+            bookmark.inventory_steps += [t] * len(products)
+            bookmark.inventory_amounts += changes.tolist()
+            bookmark.command_steps += [t] * self._n_lines
+            bookmark.command_lines += list(range(self._n_lines))
+            bookmark.command_values += old.tolist()
         self.fix_before(t)
 
 
-@contextmanager
+def _schedule_loop(
+    commands: np.ndarray,
+    inventory: np.ndarray,
+    wallet: np.ndarray,
+    steps: List[int],
+    lines: List[int],
+    process: int,
+    costs: List[int],
+    quantity: int,
+    ignore_inventory_shortage: bool,
+    ignore_money_shortage: bool,
+) -> List[Tuple[int, int, int, int]]:
+    """
+    Schedules up to `quantity` runs of `process` at the given steps/lines (in order) updating the arrays in place.
+
+    Args:
+        commands: The commands array of the simulator (n_steps * n_lines)
+        inventory: The inventory of the simulator (n_products * n_steps)
+        wallet: The wallet of the simulator (n_steps)
+        steps: Candidate steps
+        lines: Candidate lines (one for each step)
+        process: The process to run
+        costs: The cost of running the process on every line
+        quantity: The number of runs needed
+        ignore_inventory_shortage: If true, shortage in the input product is ignored
+        ignore_money_shortage: If true, shortage in money is ignored
+
+    Returns:
+        A list with the step, line, old command and cost of every scheduled run
+    """
+    runs = []
+    for s, l in zip(steps, lines):
+        if len(runs) >= quantity:
+            break
+        cost = costs[l]
+        if not ignore_inventory_shortage and inventory[process, s] < 1:
+            continue
+        if not ignore_money_shortage and wallet[s] < cost:
+            continue
+        runs.append((s, l, commands[s, l], cost))
+        commands[s, l] = process
+        inventory[process, s:] -= 1
+        inventory[process + 1, s:] += 1
+        wallet[s:] -= cost
+    return runs
+
+
+class _Transaction:
+    """Bookmarks the simulator on entry and deletes the bookmark on exit (unless an exception is raised)"""
+
+    __slots__ = ["simulator", "bookmark"]
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.bookmark = None
+
+    def __enter__(self) -> int:
+        self.bookmark = self.simulator.bookmark()
+        return self.bookmark
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        if exc_type is None:
+            self.simulator.delete_bookmark(self.bookmark)
+        return False
+
+
+class _TemporaryTransaction(_Transaction):
+    """Bookmarks the simulator on entry and rolls back to the bookmark on exit (unless an exception is raised)"""
+
+    __slots__ = []
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        if exc_type is None:
+            self.simulator.rollback(self.bookmark)
+            self.simulator.delete_bookmark(self.bookmark)
+        return False
+
+
 def transaction(simulator):
     """Runs the simulated actions then confirms them if they are not rolled back"""
-    _bookmark = simulator.bookmark()
-    yield _bookmark
-    simulator.delete_bookmark(_bookmark)
+    return _Transaction(simulator)
 
 
-@contextmanager
 def temporary_transaction(simulator):
     """Runs the simulated actions then rolls them back"""
-    _bookmark = simulator.bookmark()
-    yield _bookmark
-    simulator.rollback(_bookmark)
-    simulator.delete_bookmark(_bookmark)
+    return _TemporaryTransaction(simulator)
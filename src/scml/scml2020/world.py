@@ -480,9 +480,9 @@ class Factory:
                     self.commands[step[0] : step[1], :] >= NO_COMMAND
                 )
             else:
-                steps = np.nonzero(
+                steps = np.flatnonzero(
                     self.commands[step[0] : step[1], line] >= NO_COMMAND
-                )[0]
+                )
                 lines = [line]
         else:
             if line < 0:
@@ -490,9 +490,9 @@ class Factory:
                     self.commands[step[0] : step[1], :] == NO_COMMAND
                 )
             else:
-                steps = np.nonzero(
+                steps = np.flatnonzero(
                     self.commands[step[0] : step[1], line] == NO_COMMAND
-                )[0]
+                )
                 lines = [line]
         steps += step[0]
         possible = min(repeats, len(steps))
@@ -626,7 +626,7 @@ class Factory:
             )
 
         # do production
-        for line in np.nonzero(self.commands[step, :] != NO_COMMAND)[0]:
+        for line in np.flatnonzero(self.commands[step, :] != NO_COMMAND):
             p = self.commands[step, line]
             cost = profile.costs[line, p]
             ins, outs = self.inputs[p], self.outputs[p]
@@ -1,13 +1,20 @@
 import copy
+from types import SimpleNamespace
 from unittest import mock
 
 import numpy as np
 import pytest
 import hypothesis.strategies as st
-from hypothesis import given, example
+from hypothesis import example, settings
 
 from scml.scml2020 import FactoryProfile, Factory, NO_COMMAND, FactoryState
-from hypothesis.stateful import RuleBasedStateMachine, Bundle, rule
+from hypothesis.stateful import (
+    RuleBasedStateMachine,
+    Bundle,
+    rule,
+    invariant,
+    initialize,
+)
 
 from scml.scml2020.components import FactorySimulator
 
@@ -15,14 +22,18 @@ PROCESSES = 5
 LINES = 10
 STEPS = 50
 INITIAL = 1000
+RNG = np.random.default_rng(0)
+# factories only read these arrays so they are shared by all factories created in the tests
+IO = np.ones(PROCESSES, dtype=np.int16)
+CATALOG = RNG.integers(1, 20, size=PROCESSES + 1, dtype=np.int16)
 
 
-def create_factory():
+def create_factory(profile=None):
     return Factory(
-        create_profile(),
+        PROFILE if profile is None else profile,
         INITIAL,
-        np.ones(PROCESSES, dtype=int),
-        np.ones(PROCESSES, dtype=int),
+        IO,
+        IO,
         agent_id="aid",
         agent_name="aname",
         world=create_world(),
@@ -39,27 +50,54 @@ def create_factory():
         production_penalty=0.15,
         production_buy_missing=False,
         exogenous_buy_missing=False,
-        catalog_prices=np.random.randint(1, 20, size=PROCESSES + 1, dtype=int),
+        catalog_prices=CATALOG,
     )
 
 
 def create_profile():
     return FactoryProfile(
-        np.random.randint(1, 10, (LINES, PROCESSES), dtype=int),
-        np.random.randint(1, 10, (STEPS, PROCESSES + 1), dtype=int),
-        np.random.randint(1, 10, (STEPS, PROCESSES + 1), dtype=int),
-        np.random.randint(1, 10, (STEPS, PROCESSES + 1), dtype=int),
-        np.random.randint(1, 10, (STEPS, PROCESSES + 1), dtype=int),
+        RNG.integers(1, 10, (LINES, PROCESSES), dtype=np.int16),
+        *RNG.integers(1, 10, (4, STEPS, PROCESSES + 1), dtype=np.int16),
     )
 
 
+# factories call world methods (logging, compensation) so the world is a mock. It is only
+# read otherwise so one mock is shared by all factories created in the tests
+WORLD = mock.Mock(current_step=0, n_steps=STEPS, bankruptcy_limit=-100)
+
+
 def create_world():
-    return mock.Mock(current_step=0, n_steps=STEPS, bankruptcy_limit=-100)
+    return WORLD
+
+
+# factories only read their profile so one profile is shared by all factories created in the tests
+PROFILE = create_profile()
+
+
+def snapshot(state):
+    """Copies only the parts of a factory state compared by the tests"""
+    return SimpleNamespace(
+        balance=state.balance,
+        balance_change=state.balance_change,
+        commands=state.commands.copy(),
+        inventory=state.inventory.copy(),
+        inventory_changes=state.inventory_changes.copy(),
+    )
+
+
+_TEMPLATE_FACTORY = create_factory()
+_TEMPLATE_STATE = snapshot(_TEMPLATE_FACTORY.state)
+
+
+def clone_factory():
+    """Returns a fresh copy of a template factory (all copies share the template's world mock)"""
+    world = _TEMPLATE_FACTORY.world
+    return copy.deepcopy(_TEMPLATE_FACTORY, {id(world): world})
 
 
 @pytest.fixture
 def profile():
-    return create_profile()
+    return PROFILE
 
 
 @pytest.fixture()
@@ -85,10 +123,10 @@ class TestFactory:
     def confirm_empty(state):
         return (
             state.balance == INITIAL
-            and np.all(state.commands == NO_COMMAND)
             and state.balance_change == 0
-            and np.all(state.inventory_changes == 0)
-            and np.all(state.inventory == 0)
+            and state.commands.min() == NO_COMMAND == state.commands.max()
+            and not state.inventory_changes.any()
+            and not state.inventory.any()
         )
 
     @staticmethod
@@ -96,42 +134,73 @@ class TestFactory:
         return (
             s1.balance == s2.balance
             and s1.balance_change == s2.balance_change
-            and np.all(s1.commands == s2.commands)
-            and np.all(s1.inventory == s2.inventory)
-            and np.all(s1.inventory_changes == s2.inventory_changes)
+            and np.array_equal(s1.commands, s2.commands)
+            and np.array_equal(s1.inventory, s2.inventory)
+            and np.array_equal(s1.inventory_changes, s2.inventory_changes)
         )
 
     def test_construction(self, factory):
         assert self.confirm_empty(factory.state)
 
-    @given(
+
+def count_process(commands, process, step, line):
+    """Counts the commands running process overall, at step and at line (counting 1 for step/line if negative)"""
+    matches = commands == process
+    return (
+        np.count_nonzero(matches),
+        np.count_nonzero(matches[step, :]) if step >= 0 else 1,
+        np.count_nonzero(matches[:, line]) if line >= 0 else 1,
+    )
+
+
+class FactoryMachine(RuleBasedStateMachine):
+    """Schedules and cancels production on a single factory that is returned to its initial state after every rule"""
+
+    def __init__(self):
+        super().__init__()
+        self.factory = clone_factory()
+
+    @initialize()
+    def schedule_corners(self):
+        """Always covers the sentinel and boundary requests before the generated ones"""
+        for process, step, line in (
+            (0, -1, -1),
+            (0, -1, 0),
+            (0, 0, -1),
+            (PROCESSES - 1, STEPS - 1, LINES - 1),
+        ):
+            self.schedule_and_cancel(process, step, line)
+
+    @invariant()
+    def is_empty(self):
+        assert TestFactory.confirm_empty(self.factory.state)
+
+    @rule(
         process=st.integers(0, PROCESSES - 1),
         step=st.integers(-1, STEPS - 1),
         line=st.integers(-1, LINES - 1),
     )
-    def test_scheduling(self, process, step, line):
-        factory = create_factory()
-        assert self.confirm_empty(factory.state)
-        initial_state = copy.deepcopy(factory.state)
+    def schedule_and_cancel(self, process, step, line):
+        factory, initial_state = self.factory, _TEMPLATE_STATE
 
         factory.schedule_production(process, 1, step, line)
         state = factory.state
-        assert not self.confirm_same(initial_state, state)
-        assert len(state.commands[np.nonzero(state.commands == process)]) == 1
-        if step >= 0:
-            commands = state.commands[step, :]
-            assert len(commands[np.nonzero(commands == process)]) == 1
-        if line >= 0:
-            commands = state.commands[:, line]
-            assert len(commands[np.nonzero(commands == process)]) == 1
-
-        if step >= 0 and line >= 0:
-            assert factory.cancel_production(step, line)
-            self.confirm_empty(factory.state)
-            assert self.confirm_same(initial_state, factory.state)
-        else:
+        assert not TestFactory.confirm_same(initial_state, state)
+        assert count_process(state.commands, process, step, line) == (1, 1, 1)
+
+        if step < 0 or line < 0:
             assert not factory.cancel_production(step, line)
-            assert self.confirm_same(state, factory.state)
+            assert TestFactory.confirm_same(state, factory.state)
+            # cancel where the factory actually scheduled it to reuse the factory for the next rule
+            step, line = np.argwhere(state.commands == process)[0]
+        assert factory.cancel_production(step, line)
+        assert TestFactory.confirm_same(initial_state, factory.state)
+
+
+TestFactoryMachine = FactoryMachine.TestCase
+TestFactoryMachine.settings = settings(
+    max_examples=10, stateful_step_count=10, deadline=None
+)
 
 
 def test_simulator_runs():
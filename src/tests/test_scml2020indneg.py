@@ -0,0 +1,137 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+from scml.scml2020.agents.indneg import IndependentNegotiationsAgent
+
+STEPS = 20
+PRODUCTS = 3
+# process 0 turns 2 units of product 0 into 3 of product 1 and process 1 turns 1 unit of product 1 into 2 of product 2
+INPUTS = np.array([2, 1])
+OUTPUTS = np.array([3, 2])
+# average production costs are 5 and 15
+COSTS = np.array([[4, 10], [6, 20]])
+CATALOG = np.array([10, 20, 50])
+
+
+class Agent(IndependentNegotiationsAgent):
+    def create_ufun(self, is_seller: bool, issues=None, outcomes=None):
+        return None
+
+
+def create_agent(supplies=(), sales=(), current_step=0):
+    exogenous_supplies = np.zeros((STEPS, PRODUCTS), dtype=int)
+    exogenous_sales = np.zeros((STEPS, PRODUCTS), dtype=int)
+    for step, product, quantity in supplies:
+        exogenous_supplies[step, product] = quantity
+    for step, product, quantity in sales:
+        exogenous_sales[step, product] = quantity
+    awi = mock.Mock(
+        profile=SimpleNamespace(
+            costs=COSTS,
+            n_lines=len(COSTS),
+            exogenous_supplies=exogenous_supplies,
+            exogenous_sales=exogenous_sales,
+        ),
+        catalog_prices=CATALOG,
+        inputs=INPUTS,
+        outputs=OUTPUTS,
+        n_steps=STEPS,
+        n_products=PRODUCTS,
+        n_processes=PRODUCTS - 1,
+        current_step=current_step,
+    )
+    agent = Agent(horizon=5)
+    agent._awi = awi
+    agent.init()
+    agent.start_negotiations = mock.Mock()
+    return agent
+
+
+def create_contract(agent, product, quantity, unit_price, time, is_seller):
+    return SimpleNamespace(
+        agreement=dict(quantity=quantity, unit_price=unit_price, time=time),
+        annotation=dict(
+            product=product,
+            seller=agent.id if is_seller else "partner",
+            buyer="partner" if is_seller else agent.id,
+        ),
+    )
+
+
+def test_init_finds_average_costs():
+    agent = create_agent()
+    assert agent.costs.tolist() == [5, 15]
+
+
+def test_step_negotiates_to_sell_the_outputs_of_supplies():
+    agent = create_agent(supplies=[(1, 0, 4), (2, 1, 3)])
+    agent.step()
+    assert agent.start_negotiations.call_args_list == [
+        # 4 * 3 // 2 outputs at (5 + 2 * 10) // 3
+        mock.call(product=1, quantity=6, unit_price=8, time=6, to_buy=False),
+        # 3 * 2 // 1 outputs at (15 + 1 * 20) // 2
+        mock.call(product=2, quantity=6, unit_price=17, time=7, to_buy=False),
+    ]
+
+
+def test_step_negotiates_to_buy_the_inputs_of_sales():
+    agent = create_agent(sales=[(2, 1, 5), (3, 2, 3)])
+    agent.step()
+    assert agent.start_negotiations.call_args_list == [
+        # 5 * 2 // 3 inputs at (3 * 20 - 5) // 2
+        mock.call(product=0, quantity=3, unit_price=27, time=1, to_buy=True),
+        # 3 * 1 // 2 inputs at (2 * 50 - 15) // 1
+        mock.call(product=1, quantity=1, unit_price=85, time=2, to_buy=True),
+    ]
+
+
+def test_step_negotiates_only_every_horizon_steps():
+    agent = create_agent(supplies=[(3, 0, 4)], sales=[(3, 2, 3)], current_step=3)
+    agent.step()
+    agent.start_negotiations.assert_not_called()
+    agent.awi.current_step = 0
+    agent.step()
+    assert agent.start_negotiations.call_count == 2
+
+
+def test_sign_all_contracts_rejects_invalid_contracts():
+    agent = create_agent(current_step=2)
+    agent.awi.available_for_production.side_effect = lambda q, *args, **kwargs: (
+        np.arange(min(q, 3)),
+        np.zeros(min(q, 3)),
+    )
+    contracts = [
+        create_contract(agent, 2, 3, 40, 8, True),
+        create_contract(agent, 2, 4, 40, 8, True),
+        create_contract(agent, 2, 1, 40, STEPS, True),
+        create_contract(agent, 0, 4, 10, 1, False),
+        create_contract(agent, 0, 4, 10, 6, False),
+    ]
+    assert agent.sign_all_contracts(contracts) == [agent.id, None, None, None, agent.id]
+    assert agent.awi.available_for_production.call_count == 2
+    assert np.flatnonzero(agent.expected_sales).tolist() == [8 * PRODUCTS + 2]
+    assert agent.expected_sales[8, 2] == 3
+    assert np.flatnonzero(agent.expected_supplies).tolist() == [6 * PRODUCTS]
+    assert agent.expected_supplies[6, 0] == 4
+
+
+def test_on_contracts_finalized_negotiates_for_signed_contracts():
+    agent = create_agent(current_step=2)
+    agent.awi.schedule_production.return_value = (np.array([5, 6]), np.array([0, 1]))
+    signed = [
+        create_contract(agent, 2, 4, 40, 8, True),
+        create_contract(agent, 0, 4, 10, 6, False),
+        create_contract(agent, 0, 4, 10, 1, False),
+    ]
+    agent.on_contracts_finalized(signed, [], [])
+    agent.awi.schedule_production.assert_called_once_with(
+        process=1, repeats=4, step=(2, 7), line=-1
+    )
+    assert agent.start_negotiations.call_args_list == [
+        # 4 * 1 // 2 inputs at (2 * 40 - 15) // 1 before the first scheduled run
+        mock.call(product=1, quantity=2, unit_price=65, time=4, to_buy=True),
+        # 4 * 3 // 2 outputs at (5 + 2 * 10) // 3
+        mock.call(product=1, quantity=6, unit_price=8, time=5, to_buy=False),
+    ]
@@ -1 +1,316 @@
+import numpy as np
+
+from scml.scml2020 import FactoryProfile
 from scml.scml2020.components import simulators
+from scml.scml2020.components import FactorySimulator
+
+PROCESSES = 3
+LINES = 4
+STEPS = 10
+INITIAL = 1000
+
+
+def create_profile(costs=None):
+    if costs is None:
+        costs = np.arange(1, LINES * PROCESSES + 1, dtype=int).reshape(
+            (LINES, PROCESSES)
+        )
+    return FactoryProfile(
+        costs, *[np.zeros((STEPS, PROCESSES + 1), dtype=int) for _ in range(4)]
+    )
+
+
+def create_simulator(initial_balance=INITIAL, initial_inventory=None, costs=None):
+    return FactorySimulator(
+        create_profile(costs),
+        initial_balance=initial_balance,
+        bankruptcy_limit=0,
+        breach_penalty=0.15,
+        initial_inventory=initial_inventory,
+    )
+
+
+def test_available_for_production_clips_to_n_steps():
+    simulator = create_simulator()
+    steps, lines = simulator.available_for_production(
+        3, (5, STEPS + 2), -1, override=True, method="all"
+    )
+    assert len(steps) == (STEPS - 5) * LINES
+    assert steps.min() == 5 and steps.max() == STEPS - 1
+    steps, lines = simulator.available_for_production(
+        3, (5, STEPS + 2), 1, override=True, method="all"
+    )
+    assert steps.tolist() == list(range(5, STEPS))
+    assert np.all(lines == 1)
+    steps, _ = simulator.available_for_production(
+        1, (STEPS, STEPS + 2), -1, override=True, method="all"
+    )
+    assert len(steps) == 0
+    assert simulator.schedule(0, 3, t=(5, STEPS + 2))
+    assert not simulator.schedule(0, 1, t=(STEPS, STEPS + 2))
+
+
+def state_of(simulator):
+    t = simulator.n_steps - 1
+    return (
+        simulator.wallet_to(t).copy(),
+        simulator.inventory_to(t).copy(),
+        simulator.line_schedules_to(t).copy(),
+    )
+
+
+def assert_same_state(simulator, state):
+    for found, expected in zip(state_of(simulator), state):
+        assert np.array_equal(found, expected)
+
+
+class ReferenceSimulator:
+    """A straightforward model of the simulator keeping the full wallet, inventory and commands at every step"""
+
+    def __init__(self, costs, initial_balance, initial_inventory, bankruptcy_limit):
+        self.costs = costs
+        self.bankruptcy_limit = bankruptcy_limit
+        self.wallet = np.full(STEPS, initial_balance, dtype=int)
+        self.inventory = np.repeat(
+            np.asarray(initial_inventory).reshape(-1, 1), STEPS, axis=1
+        )
+        self.commands = np.full((STEPS, LINES), -1, dtype=int)
+        self.fixed_before = 0
+        self.bookmarks = []
+
+    def state(self):
+        return self.wallet.copy(), self.inventory.copy(), self.commands.T.copy()
+
+    def restore(self, state):
+        self.wallet, self.inventory, commands = (_.copy() for _ in state)
+        self.commands = commands.T.copy()
+
+    def buy(self, product, quantity, price, t, ignore_money_shortage):
+        if t >= STEPS:
+            return False
+        payment = price * quantity
+        if (
+            not ignore_money_shortage
+            and (self.wallet[t:] - payment).min() < self.bankruptcy_limit
+        ):
+            return False
+        self.wallet[t:] -= payment
+        self.inventory[product, t:] += quantity
+        return True
+
+    def sell(self, product, quantity, price, t, ignore_inventory_shortage):
+        if t >= STEPS:
+            return False
+        if (
+            not ignore_inventory_shortage
+            and (self.inventory[product, t:] - quantity).min() < 0
+        ):
+            return False
+        self.wallet[t:] += price * quantity
+        self.inventory[product, t:] -= quantity
+        return True
+
+    def schedule(self, process, quantity, t, line, ignore_inventory, ignore_money):
+        first, last = t
+        first, last = max(first, self.fixed_before + 1), min(last + 1, STEPS)
+        lines = range(LINES) if line < 0 else [line]
+        candidates = [(s, l) for s in range(first, last) for l in lines]
+        if len(candidates) < quantity:
+            return False
+        backup, scheduled = self.state(), 0
+        for s, l in candidates:
+            if scheduled == quantity:
+                break
+            cost = self.costs[l, process]
+            if not ignore_inventory and self.inventory[process, s] < 1:
+                continue
+            if not ignore_money and self.wallet[s] < cost:
+                continue
+            scheduled += 1
+            self.commands[s, l] = process
+            self.inventory[process, s:] -= 1
+            self.inventory[process + 1, s:] += 1
+            self.wallet[s:] -= cost
+        if scheduled < quantity:
+            self.restore(backup)
+            return False
+        return True
+
+    def set_state(self, t, inventory, wallet, commands):
+        self.inventory[:, t:] += (inventory - self.inventory[:, t]).reshape(-1, 1)
+        self.wallet[t:] += wallet - self.wallet[t]
+        self.commands[t, :] = commands
+        self.fixed_before = t
+
+
+def test_schedule_updates_state_from_the_run_step():
+    simulator = create_simulator()
+    costs = simulator._profile.costs
+    assert simulator.schedule(1, 2, t=(3, 3))
+    # both runs are scheduled at step 3 on the first two lines
+    assert simulator.line_schedules_at(3).tolist() == [1, 1, -1, -1]
+    assert np.all(simulator.line_schedules_to(STEPS - 1)[:, :3] == -1)
+    assert np.all(simulator.line_schedules_to(STEPS - 1)[:, 4:] == -1)
+    cost = costs[0, 1] + costs[1, 1]
+    assert simulator.wallet_to(STEPS - 1).tolist() == [INITIAL] * 3 + [
+        INITIAL - cost
+    ] * (STEPS - 3)
+    inventory = simulator.inventory_to(STEPS - 1)
+    assert inventory[1].tolist() == [0] * 3 + [-2] * (STEPS - 3)
+    assert inventory[2].tolist() == [0] * 3 + [2] * (STEPS - 3)
+    assert not inventory[0].any() and not inventory[3].any()
+    assert simulator.final_balance == INITIAL - cost
+    assert not simulator.is_bankrupt()
+
+
+def test_schedule_rejects_shortages_without_changes():
+    simulator = create_simulator(initial_balance=5)
+    state = state_of(simulator)
+    # no inputs in the inventory
+    assert not simulator.schedule(0, 1, t=(2, 5), ignore_inventory_shortage=False)
+    assert_same_state(simulator, state)
+    # the cheapest line costs 1 so at most 5 runs can be paid for
+    assert not simulator.schedule(
+        0, 6, t=(2, 5), line=0, ignore_money_shortage=False
+    )
+    assert_same_state(simulator, state)
+    # line 3 costs more than the whole wallet
+    assert not simulator.schedule(0, 1, t=(2, 5), line=3, ignore_money_shortage=False)
+    assert_same_state(simulator, state)
+    assert simulator.schedule(0, 5, t=(2, 8), line=0, ignore_money_shortage=False)
+    assert simulator.final_balance == 0
+
+
+def test_schedule_skips_runs_after_the_feasible_prefix():
+    simulator = create_simulator(initial_inventory=np.array([1, 0, 0, 0]))
+    assert simulator.buy(0, 2, 1, 4)
+    # the first run (step 2) is possible, the one at step 3 is not and the input bought at 4 allows the second
+    assert simulator.schedule(0, 2, t=(2, 8), line=0, ignore_inventory_shortage=False)
+    schedule = simulator.line_schedules_to(STEPS - 1)
+    assert np.flatnonzero(schedule[0] == 0).tolist() == [2, 4]
+    assert np.all(schedule[1:] == -1)
+    inventory = simulator.inventory_to(STEPS - 1)
+    assert inventory[0].tolist() == [1, 1, 0, 0, 1, 1, 1, 1, 1, 1]
+    assert inventory[1].tolist() == [0, 0, 1, 1, 2, 2, 2, 2, 2, 2]
+    # no more inputs for a third run
+    state = state_of(simulator)
+    assert not simulator.schedule(
+        0, 3, t=(2, 8), line=0, ignore_inventory_shortage=False
+    )
+    assert_same_state(simulator, state)
+
+
+def test_nested_transactions_rollback():
+    simulator = create_simulator(initial_inventory=np.array([5, 0, 0, 0]))
+    initial = state_of(simulator)
+    with simulators.temporary_transaction(simulator):
+        assert simulator.schedule(0, 2, t=(1, 4))
+        with simulators.transaction(simulator):
+            assert simulator.buy(1, 3, 10, 2)
+            assert simulator.sell(0, 1, 7, 5)
+        with simulators.temporary_transaction(simulator):
+            assert simulator.schedule(1, 1, t=(6, 6), line=2)
+        assert np.all(simulator.line_schedules_to(STEPS - 1) != 1)
+        assert simulator.wallet_at(2) < INITIAL - 30
+    assert_same_state(simulator, initial)
+    bookmark = simulator.bookmark()
+    with simulators.transaction(simulator):
+        assert simulator.schedule(0, 2, t=(1, 4))
+    assert simulator.rollback(bookmark)
+    assert simulator.delete_bookmark(bookmark)
+    assert_same_state(simulator, initial)
+
+
+def test_order_production_sets_commands_and_rolls_back():
+    simulator = create_simulator()
+    assert simulator.schedule(2, 1, t=(5, 5), line=3)
+    state = state_of(simulator)
+    bookmark = simulator.bookmark()
+    simulator.order_production(1, np.array([2, 5, 7]), np.array([0, 3, 3]))
+    schedule = simulator.line_schedules_to(STEPS - 1)
+    assert schedule[0, 2] == schedule[3, 5] == schedule[3, 7] == 1
+    assert np.count_nonzero(schedule != -1) == 3
+    # only commands change, production is paid for when it runs
+    assert_same_state(simulator, state[:2])
+    simulator.order_production(0, np.array([], dtype=int), np.array([], dtype=int))
+    assert simulator.rollback(bookmark)
+    assert simulator.delete_bookmark(bookmark)
+    assert_same_state(simulator, state)
+
+
+def test_set_state_then_rollback():
+    simulator = create_simulator(initial_inventory=np.array([2, 0, 0, 0]))
+    assert simulator.schedule(0, 1, t=(4, 4), line=1)
+    state = state_of(simulator)
+    bookmark = simulator.bookmark()
+    simulator.set_state(2, np.array([5, 1, 0, 3]), 700, np.array([0, -1, 2, -1]))
+    assert simulator.wallet_at(2) == 700
+    assert simulator.inventory_at(2).tolist() == [5, 1, 0, 3]
+    assert simulator.line_schedules_at(2).tolist() == [0, -1, 2, -1]
+    # later changes stay on top of the new state
+    assert simulator.wallet_at(4) == 700 - simulator._profile.costs[1, 0]
+    assert simulator.inventory_at(4).tolist() == [4, 2, 0, 3]
+    assert simulator.rollback(bookmark)
+    assert simulator.delete_bookmark(bookmark)
+    assert_same_state(simulator, state)
+
+
+def test_simulator_matches_reference_model():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        costs = rng.integers(1, 10, (LINES, PROCESSES))
+        balance = int(rng.integers(0, 60))
+        inventory = rng.integers(0, 4, PROCESSES + 1)
+        simulator = create_simulator(balance, inventory.copy(), costs)
+        reference = ReferenceSimulator(costs, balance, inventory, 0)
+        for _ in range(12):
+            operation = rng.integers(5)
+            if operation == 0:
+                args = (
+                    int(rng.integers(PROCESSES)),
+                    int(rng.integers(1, 5)),
+                    (int(rng.integers(STEPS + 2)), int(rng.integers(STEPS + 2))),
+                    int(rng.integers(-1, LINES)),
+                    bool(rng.integers(2)),
+                    bool(rng.integers(2)),
+                )
+                found = simulator.schedule(
+                    *args[:3],
+                    line=args[3],
+                    ignore_inventory_shortage=args[4],
+                    ignore_money_shortage=args[5],
+                )
+                expected = reference.schedule(*args)
+            elif operation in (1, 2):
+                args = (
+                    int(rng.integers(PROCESSES + 1)),
+                    int(rng.integers(1, 5)),
+                    int(rng.integers(1, 10)),
+                    int(rng.integers(reference.fixed_before, STEPS + 1)),
+                    bool(rng.integers(2)),
+                )
+                method = "buy" if operation == 1 else "sell"
+                found = getattr(simulator, method)(*args)
+                expected = getattr(reference, method)(*args)
+            elif operation == 3:
+                args = (
+                    int(rng.integers(reference.fixed_before, STEPS)),
+                    rng.integers(-3, 5, PROCESSES + 1),
+                    int(rng.integers(0, 100)),
+                    rng.integers(-1, PROCESSES, LINES),
+                )
+                simulator.set_state(*args)
+                found = expected = reference.set_state(*args)
+            else:
+                # a rolled back random schedule leaves no trace
+                reference.bookmarks.append(reference.state())
+                bookmark = simulator.bookmark()
+                simulator.schedule(int(rng.integers(PROCESSES)), 2)
+                simulator.buy(0, 1, 1, int(rng.integers(reference.fixed_before, STEPS)))
+                simulator.rollback(bookmark)
+                simulator.delete_bookmark(bookmark)
+                reference.restore(reference.bookmarks.pop())
+                found = expected = None
+            assert found == expected
+            assert_same_state(simulator, reference.state())
+            assert simulator.is_bankrupt() == (reference.wallet.min() < 0)